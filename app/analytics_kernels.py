@@ -0,0 +1,45 @@
+"""Compiled kernels for off-DB analytics post-processing.
+
+The analytics endpoints aggregate inside Postgres (GROUP BY / COPY), which
+stays the default: shipping 20 aggregate rows beats shipping millions of
+raw ones. These kernels are for in-memory post-processing that SQL cannot
+express cheaply (rolling windows, per-user streaks) over large message
+extracts fetched as NumPy arrays of epoch timestamps and integer ids.
+
+numba is an optional dependency; without it the kernels fall back to
+vectorized NumPy.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+def _count_per_room_py(room_ids, timestamps, lo, hi, n_rooms):
+    out = np.zeros(n_rooms, np.int64)
+    for i in range(len(timestamps)):
+        if lo <= timestamps[i] <= hi:
+            out[room_ids[i]] += 1
+    return out
+
+
+if HAS_NUMBA:
+    # cache=True persists the compiled kernel so only the first call ever
+    # pays the compile cost. Kept serial: the scatter into out[room_ids[i]]
+    # is a data race under prange.
+    count_per_room = njit(cache=True)(_count_per_room_py)
+else:
+    def count_per_room(room_ids, timestamps, lo, hi, n_rooms):
+        mask = (timestamps >= lo) & (timestamps <= hi)
+        return np.bincount(room_ids[mask], minlength=n_rooms).astype(np.int64)
+
+count_per_room.__doc__ = """Count messages per room within [lo, hi].
+
+    Args are int64 NumPy arrays of room ids and epoch timestamps plus the
+    inclusive epoch bounds and the number of rooms; returns an int64 array
+    of counts indexed by room id.
+    """
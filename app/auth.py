@@ -1,7 +1,11 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import APIKeyHeader
-from jose import jwt, JWTError
+import jwt
+from jwt import InvalidTokenError as JWTError
+from cachetools import TLRUCache
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,12 +13,26 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 
+def _token_ttu(_key, value, now):
+    """Expire cached tokens at their own exp claim (default 5 min if absent)."""
+    exp = value.get("exp")
+    return exp if exp is not None else now + 300
+
+# Cache of already-verified tokens: raw token → claims. Signature
+# verification runs on every request otherwise; the same bearer token is
+# reused for its whole lifetime, so cache hits skip the crypto entirely.
+# cachetools caches are not thread-safe and decode_token runs both on the
+# event loop (WebSocket) and in the threadpool (sync dependencies), so all
+# access goes through the lock — even reads mutate the LRU/expiry links.
+_TOKEN_CACHE: TLRUCache = TLRUCache(maxsize=10_000, ttu=_token_ttu, timer=time.time)
+_TOKEN_CACHE_LOCK = threading.Lock()
+
 # Extract Authorization header for HTTP requests
 api_key_header = APIKeyHeader(name="Authorization")
 
 def decode_token(token: str, expect_bearer: bool = True):
     """
-    Decode and validate JWT; returns {"username": ..., "role": ...}.
+    Decode and validate JWT; returns {"username": ..., "role": ..., "uid": ...}.
     Raises HTTP 401 if invalid.
     """
     if expect_bearer:
@@ -26,6 +44,11 @@ def decode_token(token: str, expect_bearer: bool = True):
             )
         token = token[len("Bearer "):]  # Remove 'Bearer ' prefix
 
+    with _TOKEN_CACHE_LOCK:
+        hit = _TOKEN_CACHE.get(token)
+    if hit is not None:
+        return {"username": hit["username"], "role": hit["role"], "uid": hit.get("uid")}
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -36,7 +59,11 @@ def decode_token(token: str, expect_bearer: bool = True):
                 detail="Invalid token payload",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        return {"username": username, "role": role}
+        uid = payload.get("uid")
+        # Only successful verifications are cached
+        with _TOKEN_CACHE_LOCK:
+            _TOKEN_CACHE[token] = {"username": username, "role": role, "uid": uid, "exp": payload.get("exp")}
+        return {"username": username, "role": role, "uid": uid}
 
     except JWTError:
         raise HTTPException(
@@ -1,10 +1,13 @@
+import asyncio
+
 from database import engine, Base
 from models import User, Message, Room
 
-def create_tables():
+async def create_tables():
     """Create all tables in the database."""
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
 
 if __name__ == "__main__":
-    create_tables()  # Run table creation
+    asyncio.run(create_tables())  # Run table creation
     print("Tables Created Successfully")
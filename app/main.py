@@ -1,16 +1,19 @@
 from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect, Query, status
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-from jose import jwt
-from pydantic import BaseModel
+from sqlalchemy.orm import joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import jwt
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 from datetime import datetime, date
 from typing import Optional
 from sqlalchemy import func
-from fastapi.responses import StreamingResponse
-import io
-import csv
+from fastapi.responses import StreamingResponse, ORJSONResponse
+import asyncio
+import bcrypt
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 from database import SessionLocal, engine
 from models import User, Message, Room
@@ -23,10 +26,18 @@ from fastapi import Depends
 
 load_dotenv()
 
-app = FastAPI()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+app = FastAPI(default_response_class=ORJSONResponse)
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
+BCRYPT_COST = int(os.getenv("BCRYPT_COST", "12"))  # Tunable bcrypt work factor
+
+# Once any user exists the "first user becomes admin" answer never changes;
+# remember it so signup stops querying for it.
+_ADMIN_BOOTSTRAPPED = False
+
+# Bcrypt burns a full core for hundreds of ms per call; a process pool lets
+# N concurrent logins use N cores instead of queueing on the thread pool.
+_PW_POOL = ProcessPoolExecutor(max_workers=os.cpu_count())
 
 
 # --- Admin panel setup ---
@@ -40,24 +51,23 @@ def admin_auth_dependency(user=Depends(get_current_user)):
 # Admin views for tables
 class UserAdmin(ModelView, model=User):
     dependencies = [Depends(admin_auth_dependency)]
+    # message_count is a mapped aggregate column (see models.py), no per-row loads
     column_list = ["id", "username", "role", "message_count"]
 
-    def message_count(self, obj: User):
-        return len(obj.messages)
-
 
 class RoomAdmin(ModelView, model=Room):
     dependencies = [Depends(admin_auth_dependency)]
     column_list = ["id", "name", "description", "message_count"]
 
-    def message_count(self, obj: Room):
-        return len(obj.messages)
-
 
 class MessageAdmin(ModelView, model=Message):
     dependencies = [Depends(admin_auth_dependency)]
     column_list = ["id", "content", "timestamp", "sender_username", "room_name"]
 
+    def list_query(self, request):
+        """Eager-load sender and room so list rows don't lazy-load each."""
+        return select(Message).options(joinedload(Message.sender), joinedload(Message.room))
+
     def sender_username(self, obj: Message):
         return obj.sender.username if obj.sender else "Unknown"
 
@@ -74,7 +84,9 @@ admin.add_view(MessageAdmin)
 
 # --- Schemas ---
 class UserCreate(BaseModel):
-    username: str
+    # Matches the String(64) column bound; longer names 422 at validation
+    # instead of erroring at insert
+    username: str = Field(max_length=64)
     password: str
 
 class UserLogin(BaseModel):
@@ -87,48 +99,104 @@ class RoomCreate(BaseModel):
 
 
 # --- Helpers ---
-def get_db():
+async def get_db():
     """Provide DB session."""
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+def _day_start(day: date):
+    return datetime(day.year, day.month, day.day)
+
+def _day_end(day: date):
+    return datetime(day.year, day.month, day.day, 23, 59, 59, 999999)
+
+def _date_conditions(start_date: Optional[date], end_date: Optional[date]):
+    """Message-timestamp conditions for an inclusive calendar-day range."""
+    conditions = []
+    if start_date:
+        conditions.append(Message.timestamp >= _day_start(start_date))
+    if end_date:
+        conditions.append(Message.timestamp <= _day_end(end_date))
+    return conditions
+
+def _messages_per_room_query(start_date: Optional[date], end_date: Optional[date]):
+    """Aggregate message counts per room, optionally date-bounded.
+
+    Left join so rooms without messages show up with a zero count; the
+    date filter lives in the join condition for the same reason.
+    """
+    return (
+        select(Room.name, func.coalesce(func.count(Message.id), 0).label("message_count"))
+        .select_from(Room)
+        .outerjoin(Message, and_(Message.room_id == Room.id, *_date_conditions(start_date, end_date)))
+        .group_by(Room.id)
+    )
+
+def _user_activity_query(start_date: Optional[date], end_date: Optional[date]):
+    """Aggregate messages sent per user, optionally date-bounded.
+
+    Left join so inactive users show up with a zero count.
+    """
+    return (
+        select(User.username, func.coalesce(func.count(Message.id), 0).label("messages_sent"))
+        .select_from(User)
+        .outerjoin(Message, and_(Message.sender_id == User.id, *_date_conditions(start_date, end_date)))
+        .group_by(User.id)
+    )
 
 def hash_password(password: str):
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_COST)).decode()
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
 
 
 # --- Auth routes ---
 @app.post("/signup")
-def signup(user: UserCreate, db: Session = Depends(get_db)):
+async def signup(user: UserCreate, db: AsyncSession = Depends(get_db)):
     """Register user; first user becomes admin."""
-    existing_user = db.query(User).filter(User.username == user.username).first()
-    if existing_user:
+    global _ADMIN_BOOTSTRAPPED
+
+    if _ADMIN_BOOTSTRAPPED:
+        assigned_role = "user"
+    else:
+        # EXISTS stops at the first row, unlike COUNT(*) which scans them all
+        any_user = await db.scalar(select(select(User.id).exists()))
+        assigned_role = "user" if any_user else "admin"
+
+    # Run CPU-heavy bcrypt in the process pool
+    hashed_pw = await asyncio.get_running_loop().run_in_executor(_PW_POOL, hash_password, user.password)
+
+    # One atomic round-trip: the unique index detects collisions, so no
+    # separate pre-check SELECT (and no race between check and insert)
+    stmt = (
+        pg_insert(User)
+        .values(username=user.username, password_hash=hashed_pw, role=assigned_role)
+        .on_conflict_do_nothing(index_elements=["username"])
+        .returning(User.id)
+    )
+    new_id = (await db.execute(stmt)).scalar()
+    await db.commit()
+    if new_id is None:
         raise HTTPException(status_code=400, detail="Username already taken")
+    _ADMIN_BOOTSTRAPPED = True
 
-    user_count = db.query(User).count()
-    assigned_role = "admin" if user_count == 0 else "user"
-
-    hashed_pw = hash_password(user.password)
-    new_user = User(username=user.username, password_hash=hashed_pw, role=assigned_role)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-
-    return {"message": "User Created Successfully", "username": new_user.username}
+    return {"message": "User Created Successfully", "username": user.username}
 
 @app.post("/login")
-def login(user: UserLogin, db: Session = Depends(get_db)):
+async def login(user: UserLogin, db: AsyncSession = Depends(get_db)):
     """Authenticate user and return JWT."""
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if not db_user or not verify_password(user.password, db_user.password_hash):
+    # Fetch only the columns login needs instead of hydrating a full User
+    db_user = (await db.execute(
+        select(User.id, User.username, User.password_hash, User.role)
+        .where(User.username == user.username)
+    )).one_or_none()
+    if not db_user or not await asyncio.get_running_loop().run_in_executor(
+        _PW_POOL, verify_password, user.password, db_user.password_hash
+    ):
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    token_data = {"sub": db_user.username, "role": db_user.role}
+    token_data = {"sub": db_user.username, "role": db_user.role, "uid": db_user.id}
     token = jwt.encode(token_data, SECRET_KEY, algorithm=ALGORITHM)
     return {"access_token": token, "token_type": "bearer"}
 
@@ -143,80 +211,88 @@ def admin_route(current_user: dict = Depends(require_role("admin"))):
 
 # --- Room management ---
 @app.post("/rooms")
-def create_room(room: RoomCreate, db: Session = Depends(get_db), current_user: dict = Depends(require_role("admin"))):
+async def create_room(room: RoomCreate, db: AsyncSession = Depends(get_db), current_user: dict = Depends(require_role("admin"))):
     """Create chat room (admin only)."""
-    existing_room = db.query(Room).filter(Room.name == room.name).first()
-    if existing_room:
+    stmt = (
+        pg_insert(Room)
+        .values(name=room.name, description=room.description)
+        .on_conflict_do_nothing(index_elements=["name"])
+        .returning(Room.id)
+    )
+    new_id = (await db.execute(stmt)).scalar()
+    await db.commit()
+    if new_id is None:
         raise HTTPException(status_code=400, detail="Room with this name already exists")
 
-    new_room = Room(name=room.name, description=room.description)
-    db.add(new_room)
-    db.commit()
-    db.refresh(new_room)
-
-    return {"message": "Room created successfully", "room_id": new_room.id, "name": new_room.name}
+    return {"message": "Room created successfully", "room_id": new_id, "name": room.name}
 
 @app.get("/rooms")
-def list_rooms(db: Session = Depends(get_db)):
+async def list_rooms(db: AsyncSession = Depends(get_db)):
     """List all chat rooms."""
-    return db.query(Room).all()
+    # Explicit columns: loading Room entities would also run the
+    # message_count aggregate subquery per row (admin-panel only)
+    rows = (await db.execute(select(Room.id, Room.name, Room.description))).all()
+    return [{"id": r.id, "name": r.name, "description": r.description} for r in rows]
 
 
 # --- Analytics ---
 @app.get("/analytics/messages-per-room")
-def messages_per_room(
+async def messages_per_room(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: dict = Depends(require_role("admin"))
 ):
     """Message count by room with optional date filter."""
-    query = db.query(Room.name, func.count(Message.id).label("message_count")).join(Message)
-    if start_date:
-        query = query.filter(Message.timestamp >= datetime.combine(start_date, datetime.min.time()))
-    if end_date:
-        query = query.filter(Message.timestamp <= datetime.combine(end_date, datetime.max.time()))
-    results = query.group_by(Room.id).all()
+    results = (await db.execute(_messages_per_room_query(start_date, end_date))).all()
     return [{"room": r[0], "message_count": r[1]} for r in results]
 
 @app.get("/analytics/user-activity")
-def user_activity(
+async def user_activity(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: dict = Depends(require_role("admin"))
 ):
     """User activity (messages sent) with optional date filter."""
-    query = db.query(User.username, func.count(Message.id).label("messages_sent")).join(Message)
-    if start_date:
-        query = query.filter(Message.timestamp >= datetime.combine(start_date, datetime.min.time()))
-    if end_date:
-        query = query.filter(Message.timestamp <= datetime.combine(end_date, datetime.max.time()))
-    results = query.group_by(User.id).all()
+    results = (await db.execute(_user_activity_query(start_date, end_date))).all()
     return [{"username": r[0], "messages_sent": r[1]} for r in results]
 
 @app.get("/analytics/messages-per-room/csv")
-def messages_per_room_csv(
+async def messages_per_room_csv(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: dict = Depends(require_role("admin"))
 ):
-    """Download messages-per-room analytics as CSV."""
-    query = db.query(Room.name, func.count(Message.id).label("message_count")).join(Message)
+    """Download messages-per-room analytics as CSV via server-side COPY."""
+    # Mirrors _messages_per_room_query as hand-written SQL: COPY runs on the
+    # raw asyncpg connection, outside the ORM compiler
+    sql = (
+        'SELECT rooms.name AS "Room", coalesce(count(messages.id), 0) AS "Message Count" '
+        "FROM rooms LEFT JOIN messages ON messages.room_id = rooms.id"
+    )
+    params = []
+    # Date filters belong in the join condition so zero-message rooms survive
     if start_date:
-        query = query.filter(Message.timestamp >= datetime.combine(start_date, datetime.min.time()))
+        params.append(_day_start(start_date))
+        sql += f" AND messages.timestamp >= ${len(params)}"
     if end_date:
-        query = query.filter(Message.timestamp <= datetime.combine(end_date, datetime.max.time()))
-    results = query.group_by(Room.id).all()
+        params.append(_day_end(end_date))
+        sql += f" AND messages.timestamp <= ${len(params)}"
+    sql += " GROUP BY rooms.id"
+
+    # Let Postgres render the CSV itself instead of building it row-by-row
+    # with csv.writer; COPY streams compact chunks straight off the wire.
+    chunks = []
+
+    async def sink(data: bytes):
+        chunks.append(data)
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Room", "Message Count"])
-    for r in results:
-        writer.writerow([r[0], r[1]])
-    output.seek(0)
-    return StreamingResponse(output, media_type="text/csv", headers={"Content-Disposition": "attachment; filename=messages_per_room.csv"})
+    raw = await (await db.connection()).get_raw_connection()
+    await raw.driver_connection.copy_from_query(sql, *params, output=sink, format="csv", header=True)
+
+    return StreamingResponse(iter(chunks), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=messages_per_room.csv"})
 
 
 # --- WebSocket endpoint ---
@@ -236,48 +312,64 @@ async def websocket_endpoint(websocket: WebSocket, room_id: int):
         await websocket.close(code=1008)
         return
 
-    db = SessionLocal()
-    room = db.query(Room).filter(Room.id == room_id).first()
-    if not room:
-        await websocket.close(code=1008)
-        db.close()
-        return
-
-    await manager.connect(str(room_id), websocket)
-
-    try:
-        # Send last 20 messages
-        recent_messages = (
-            db.query(Message)
-            .filter(Message.room_id == room_id)
-            .order_by(Message.timestamp.desc())
-            .limit(20)
-            .all()
-        )
-        for msg in reversed(recent_messages):
-            await websocket.send_json({
-                "username": msg.sender.username,
-                "content": msg.content,
-                "timestamp": msg.timestamp.isoformat()
-            })
-
-        # Handle new messages
-        while True:
-            data = await websocket.receive_text()
-            sender = db.query(User).filter(User.username == current_user["username"]).first()
-            new_message = Message(room_id=room_id, sender_id=sender.id, content=data, timestamp=datetime.utcnow())
-            db.add(new_message)
-            db.commit()
-            db.refresh(new_message)
-
-            broadcast_data = {
-                "username": sender.username,
-                "content": new_message.content,
-                "timestamp": new_message.timestamp.isoformat()
-            }
-            await manager.broadcast(str(room_id), broadcast_data)
-
-    except WebSocketDisconnect:
-        await manager.disconnect(str(room_id), websocket)
-    finally:
-        db.close()
+    async with SessionLocal() as db:
+        # Existence check only — a full Room load would drag in the
+        # message_count aggregate on every connect
+        room_exists = await db.scalar(select(Room.id).where(Room.id == room_id))
+        if room_exists is None:
+            await websocket.close(code=1008)
+            return
+
+        await manager.connect(str(room_id), websocket)
+
+        try:
+            # Send last 20 messages
+            recent_messages = (
+                (await db.execute(
+                    select(Message)
+                    .options(joinedload(Message.sender))
+                    .where(Message.room_id == room_id)
+                    .order_by(Message.timestamp.desc())
+                    .limit(20)
+                ))
+                .scalars()
+                .all()
+            )
+            history = [
+                {
+                    "username": msg.sender.username,
+                    "content": msg.content,
+                    "timestamp": msg.timestamp.isoformat()
+                }
+                for msg in reversed(recent_messages)
+            ]
+            await websocket.send_json({"type": "history", "messages": history})
+
+            # Resolve sender once; the JWT carries the id (uid claim), older
+            # tokens fall back to a single lookup
+            sender_id = current_user.get("uid")
+            if sender_id is None:
+                sender_id = await db.scalar(select(User.id).where(User.username == current_user["username"]))
+            sender_username = current_user["username"]
+
+            # Handle new messages
+            while True:
+                data = await websocket.receive_text()
+                # Single round-trip: insert and read back id/timestamp via RETURNING
+                stmt = (
+                    insert(Message)
+                    .values(room_id=room_id, sender_id=sender_id, content=data, timestamp=datetime.utcnow())
+                    .returning(Message.id, Message.timestamp)
+                )
+                row = (await db.execute(stmt)).one()
+                await db.commit()
+
+                broadcast_data = {
+                    "username": sender_username,
+                    "content": data,
+                    "timestamp": row.timestamp.isoformat()
+                }
+                await manager.broadcast(str(room_id), broadcast_data)
+
+        except WebSocketDisconnect:
+            await manager.disconnect(str(room_id), websocket)
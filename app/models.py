@@ -1,20 +1,27 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Index, select, func
 from database import Base
 from datetime import datetime
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, column_property
 
 # --- User model ---
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
-    username = Column(String, unique=True, index=True, nullable=False)
-    password_hash = Column(String, nullable=False)
+    # Bounded widths keep tuples inline (bcrypt output is always 60 bytes)
+    # instead of TOASTed TEXT that costs an extra fetch on every login
+    username = Column(String(64), unique=True, index=True, nullable=False)
+    password_hash = Column(String(60), nullable=False)
     role = Column(String, default="user", nullable=False)
 
     # Relationship: user → messages
     messages = relationship("Message", back_populates="sender")
 
+    __table_args__ = (
+        # Covering index: username → id resolves as an index-only scan
+        Index("ix_users_username_id", "username", postgresql_include=["id"]),
+    )
+
 
 # --- Room model ---
 class Room(Base):
@@ -41,3 +48,27 @@ class Message(Base):
     # Relationships: message → sender & room
     sender = relationship("User", back_populates="messages")
     room = relationship("Room", back_populates="messages")
+
+    __table_args__ = (
+        # Serves the "last 20 messages per room" query as an index range scan
+        Index("ix_messages_room_ts", "room_id", timestamp.desc()),
+        # Serves analytics grouped by sender with date-range filters
+        Index("ix_messages_sender_ts", "sender_id", "timestamp"),
+    )
+
+
+# Aggregate message counts as correlated subqueries, so listing users/rooms
+# emits a single query instead of lazy-loading every message per row.
+User.message_count = column_property(
+    select(func.count(Message.id))
+    .where(Message.sender_id == User.id)
+    .correlate_except(Message)
+    .scalar_subquery()
+)
+
+Room.message_count = column_property(
+    select(func.count(Message.id))
+    .where(Message.room_id == Room.id)
+    .correlate_except(Message)
+    .scalar_subquery()
+)
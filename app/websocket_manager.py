@@ -1,38 +1,50 @@
-from typing import Dict, List
+from typing import Dict, Set
+from collections import defaultdict
 from fastapi import WebSocket
 import asyncio
+import orjson
 
 class ConnectionManager:
     def __init__(self):
-        # Active room connections: room_id → list of WebSocket clients
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-        self.lock = asyncio.Lock()  # Ensure thread-safe operations
+        # Active room connections: room_id → set of WebSocket clients
+        self.active_connections: Dict[str, Set[WebSocket]] = {}
+        # Per-room locks so rooms don't serialize each other's joins/leaves
+        self.locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
 
     async def connect(self, room_id: str, websocket: WebSocket):
         """Add client WebSocket to a room."""
-        async with self.lock:
+        async with self.locks[room_id]:
             if room_id not in self.active_connections:
-                self.active_connections[room_id] = []
-            self.active_connections[room_id].append(websocket)
+                self.active_connections[room_id] = set()
+            self.active_connections[room_id].add(websocket)
 
     async def disconnect(self, room_id: str, websocket: WebSocket):
         """Remove client WebSocket from a room."""
-        async with self.lock:
+        async with self.locks[room_id]:
             if room_id in self.active_connections:
-                if websocket in self.active_connections[room_id]:
-                    self.active_connections[room_id].remove(websocket)
+                self.active_connections[room_id].discard(websocket)
                 if not self.active_connections[room_id]:
                     del self.active_connections[room_id]  # Cleanup empty room
 
     async def broadcast(self, room_id: str, message: dict):
         """Send message to all clients in a room."""
-        async with self.lock:
-            if room_id in self.active_connections:
-                # Send concurrently to all clients
-                await asyncio.gather(*[
-                    connection.send_json(message)
-                    for connection in self.active_connections[room_id]
-                ])
+        # Snapshot under the lock, then fan out without holding it — a slow
+        # client must not block joins/leaves or other broadcasts.
+        async with self.locks[room_id]:
+            connections = list(self.active_connections.get(room_id, ()))
+        if not connections:
+            return
+
+        # Encode once and reuse; send_json would re-serialize per recipient
+        payload = orjson.dumps(message).decode()
+        results = await asyncio.gather(
+            *[connection.send_text(payload) for connection in connections],
+            return_exceptions=True,
+        )
+        # Drop sockets whose send failed (client gone mid-broadcast)
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                await self.disconnect(room_id, connection)
 
 # Global instance of connection manager
 manager = ConnectionManager()